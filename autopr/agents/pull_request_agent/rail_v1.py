@@ -1,3 +1,4 @@
+import functools
 from typing import Union, Optional
 
 import pydantic
@@ -21,6 +22,7 @@ class InitialFileSelectResponse(RailObject):
     filepaths: list[str]
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_rail_spec(cls):
         return f"""
 <rail version="0.1">
@@ -91,6 +93,7 @@ class LookAtFilesResponse(RailObject):
     notes: str
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_rail_spec(cls):
         return f"""
 <rail version="0.1">
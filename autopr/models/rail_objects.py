@@ -1,3 +1,4 @@
+import functools
 import json
 from typing import List, ClassVar, Optional, Union
 from typing_extensions import TypeAlias
@@ -20,11 +21,14 @@ class RailObject(pydantic.BaseModel):
     output_spec: ClassVar[str]
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_rail_spec(cls):
         """
         Get the XML spec template used to define the guardrails output.
         Should include a `{{raw_document}}` in the prompt section,
         which will be replaced by the input prompt/two-step LLM output.
+
+        The spec only depends on the class' `output_spec`, so it is cached per subclass.
         """
         return f"""
 <rail version="0.1">
@@ -130,16 +134,22 @@ class PullRequestDescription(RailObject):
     body: str
     commits: list[CommitPlan]
 
+    def _render_arrays(self) -> tuple[list[str], list[str], list[list[str]]]:
+        messages = [c.commit_message for c in self.commits]
+        filepaths_joined = [', '.join([str(fh) for fh in c.relevant_file_hunks]) for c in self.commits]
+        changes_lines = [c.commit_changes_description.splitlines() for c in self.commits]
+        return messages, filepaths_joined, changes_lines
+
     def __str__(self):
-        pr_text_description = f"Title: {self.title}\n\n{self.body}\n\n"
-        for i, commit_plan in enumerate(self.commits):
-            prefix = f" {' ' * len(str(i + 1))}  "
+        parts = [f"Title: {self.title}\n\n{self.body}\n\n"]
+        for i, (message, filepaths, changes_lines) in enumerate(zip(*self._render_arrays())):
+            idx_str = str(i + 1)
+            prefix = f" {' ' * len(idx_str)}  "
             changes_prefix = f"\n{prefix}  "
-            pr_text_description += (
-                f"{str(i + 1)}. Commit: {commit_plan.commit_message}\n"
-                f"{prefix}Files: "
-                f"{', '.join([str(fh) for fh in commit_plan.relevant_file_hunks])}\n"
+            parts.append(
+                f"{idx_str}. Commit: {message}\n"
+                f"{prefix}Files: {filepaths}\n"
                 f"{prefix}Changes:"
-                f"{changes_prefix}{changes_prefix.join(commit_plan.commit_changes_description.splitlines())}\n"
+                f"{changes_prefix}{changes_prefix.join(changes_lines)}\n"
             )
-        return pr_text_description
+        return ''.join(parts)
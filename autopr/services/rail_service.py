@@ -1,3 +1,4 @@
+import functools
 import json
 import traceback
 from typing import Callable, Any, Optional, TypeVar, Type
@@ -202,10 +203,19 @@ class RailService:
         return self.run_rail_object(rail.output_type, prompt)
 
     @staticmethod
-    def get_rail_message(rail_object: type[RailObject], raw_document: str):
+    @functools.lru_cache(maxsize=None)
+    def get_rail_base_prompt(rail_object: type[RailObject]) -> str:
+        """
+        Parse the rail spec of `rail_object` into its prompt template.
+        Parsing the rail XML is expensive and the result only depends on the class, so it is cached.
+        """
         spec = rail_object.get_rail_spec()
         pr_guard = gr.Guard.from_rail_string(spec)
-        return pr_guard.base_prompt.format(raw_document=raw_document)
+        return pr_guard.base_prompt
+
+    @staticmethod
+    def get_rail_message(rail_object: type[RailObject], raw_document: str):
+        return RailService.get_rail_base_prompt(rail_object).format(raw_document=raw_document)
 
     def calculate_rail_length(self, rail_object: Type[RailObject], raw_document: str) -> int:
         rail_message = self.get_rail_message(rail_object, raw_document)
@@ -17,3 +17,12 @@ def test_guardrails_spec_validity(rail_type):
     rail_spec = rail_type.get_rail_spec()
     print(rail_spec)
     gr.Guard.from_rail_string(rail_spec)
+
+
+@pytest.mark.parametrize(
+    "rail_type",
+    RailObject.__subclasses__()
+)
+def test_rail_spec_is_cached(rail_type):
+    """Test that the rail spec is built once per RailObject subclass."""
+    assert rail_type.get_rail_spec() is rail_type.get_rail_spec()
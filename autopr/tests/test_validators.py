@@ -1,7 +1,8 @@
 import os
 import tempfile
+from pathlib import Path
 from typing import Optional
-from unittest.mock import Mock, MagicMock
+from unittest.mock import Mock
 
 from git.repo import Repo
 import pytest
@@ -9,7 +10,7 @@ from git import GitCommandError
 
 from autopr.services.diff_service import GitApplyService, PatchService
 from guardrails.validators import EventDetail
-from autopr.validators import create_unidiff_validator
+from autopr.validators import create_unidiff_validator, _parse_hunk_header
 
 
 def run_diff_tests_for_file(
@@ -69,58 +70,121 @@ def run_diff_tests_for_file(
         repo.git.execute(['git', 'clean', '-f'])
 
 
-def test_unidiff(subtests):
+def _collect_unidiff_cases() -> list:
     # Find all test cases in {this_dir}/resources/unidiff
-    # Run the test for each file
+    # Only the paths are collected here, fixture contents are read when the test runs
     test_dir = os.path.dirname(os.path.abspath(__file__))
     test_cases_dir = os.path.join(test_dir, 'resources', 'unidiff')
-    for test_identifier in os.listdir(test_cases_dir):
+    with os.scandir(test_cases_dir) as it:
+        test_case_entries = sorted(it, key=lambda entry: entry.name)
+
+    cases = []
+    for test_case_entry in test_case_entries:
+        test_identifier = test_case_entry.name
         if '%' in test_identifier:
             dir_path_split = test_identifier.split('%')
             filepath = os.path.join(*dir_path_split)
             filename = dir_path_split[-1]
         else:
             filepath = filename = test_identifier
-        with subtests.test(filename):
-            test_case_dir = os.path.join(test_cases_dir, test_identifier)
-            # Assert there is a `correct.diff`
-            correct_diff_path = os.path.join(test_case_dir, 'correct.diff')
-            assert os.path.exists(correct_diff_path)
-            # Assert there is at least one other `.diff` file
-            other_diff_names = [
-                f for f in os.listdir(test_case_dir)
-                if f.endswith('.diff') and f != 'correct.diff'
-            ]
-            assert len(other_diff_names) > 0
-            # Assert there is a file named f"after_{filename}"
-            after_file_path = os.path.join(test_case_dir, f"after_{filename}")
-            assert os.path.exists(after_file_path)
-
-            # Read the correct diff
-            with open(correct_diff_path, 'r') as f:
-                correct_unidiff = f.read()
-            # Read the file contents after the diff
-            with open(after_file_path, 'r') as f:
-                file_contents_after = f.read()
-            # Read the file contents before the diff (if exists)
-            before_file_path = os.path.join(test_case_dir, filename)
-            if os.path.exists(before_file_path):
-                with open(before_file_path, 'r') as f:
-                    file_contents_before = f.read()
-            else:
-                # If there is no before file, the file is created
-                file_contents_before = None
-            # Read the other diffs
-            other_diffs = []
-            for diff_filename in other_diff_names:
-                diff_path = os.path.join(test_case_dir, diff_filename)
-                with open(diff_path, 'r') as f:
-                    other_diffs.append((diff_filename, f.read()))
-            run_diff_tests_for_file(
-                subtests,
-                filepath,
-                file_contents_before,
-                file_contents_after,
-                correct_unidiff,
-                other_diffs,
-            )
+        cases.append(pytest.param(
+            filepath,
+            filename,
+            test_case_entry.path,
+            id=test_identifier,
+        ))
+    return cases
+
+
+@pytest.mark.parametrize(
+    "filepath, filename, test_case_dir",
+    _collect_unidiff_cases(),
+)
+def test_unidiff(subtests, filepath, filename, test_case_dir):
+    with os.scandir(test_case_dir) as it:
+        dir_map = {entry.name: entry for entry in it}
+    # Assert there is a `correct.diff`
+    assert 'correct.diff' in dir_map
+    # Assert there is at least one other `.diff` file
+    other_diffs = [
+        (entry.name, Path(entry.path).read_text())
+        for entry in sorted(dir_map.values(), key=lambda entry: entry.name)
+        if entry.name.endswith('.diff') and entry.name != 'correct.diff'
+    ]
+    assert len(other_diffs) > 0
+    # Assert there is a file named f"after_{filename}"
+    assert f"after_{filename}" in dir_map
+
+    # Read the correct diff
+    correct_unidiff = Path(dir_map['correct.diff'].path).read_text()
+    # Read the file contents after the diff
+    file_contents_after = Path(dir_map[f"after_{filename}"].path).read_text()
+    # Read the file contents before the diff (if exists)
+    if filename in dir_map:
+        file_contents_before = Path(dir_map[filename].path).read_text()
+    else:
+        # If there is no before file, the file is created
+        file_contents_before = None
+    run_diff_tests_for_file(
+        subtests,
+        filepath,
+        file_contents_before,
+        file_contents_after,
+        correct_unidiff,
+        other_diffs,
+    )
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("@@ -1,3 +1,4 @@", (1, 1)),
+        ("@@ -12 +15,2 @@ def foo():", (12, 15)),
+        ("@@ -0,0 +1 @@", (0, 1)),
+        ("@@ -1,3 +1,4", None),
+        ("@@ -a,3 +1,4 @@", None),
+        ("@@ -1,3 1,4 @@", None),
+        ("@@  -1,3 +1,4 @@", None),
+        ("@@ -1,3, +1,4 @@", None),
+        ("@@ @@", None),
+    ],
+)
+def test_parse_hunk_header(line, expected):
+    assert _parse_hunk_header(line) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        # Creating an empty file
+        "diff --git a/pkg/__init__.py b/pkg/__init__.py\nnew file mode 100644\nindex 0000000..e69de29\n",
+        # Pure rename
+        "diff --git a/a.py b/b.py\nsimilarity index 100%\nrename from a.py\nrename to b.py\n",
+        # Context diff
+        "*** a.py\n--- a.py\n***************\n*** 1 ****\n! a\n--- 1 ----\n! b\n",
+    ],
+)
+def test_unidiff_validate_leaves_diffs_without_hunks_to_diff_service(value):
+    diff_service = Mock()
+    validator = create_unidiff_validator(Mock(), diff_service)(on_fail="fix")
+    assert validator.validate("diff", value, {"diff": value}) == {"diff": value}
+    diff_service.apply_diff.assert_called_once_with(value, check=True)
+
+
+def test_unidiff_validate_rejects_diff_after_applying_it():
+    tmp_dir = tempfile.TemporaryDirectory()
+    with open(os.path.join(tmp_dir.name, 'a.py'), 'w') as f:
+        f.write("a\n")
+    repo = Repo.init(tmp_dir.name)
+    repo.index.add(['a.py'])
+    repo.git.execute(['git', 'commit', '-m', 'Initial commit'])
+
+    value = "--- a.py\n+++ a.py\n@@ -1,1 +1,1 @@\n-a\n+b\n"
+    diff_service = PatchService(repo=repo)
+    validator = create_unidiff_validator(repo, diff_service)(on_fail="fix")
+    validator.validate("diff", value, {"diff": value})
+
+    # The working tree changes without HEAD moving, so the diff no longer applies
+    diff_service.apply_diff(value)
+    with pytest.raises(EventDetail):
+        validator.validate("diff", value, {"diff": value})
@@ -1,5 +1,4 @@
 import os
-import re
 from typing import Union, Any, Dict, List, Optional
 
 from git import GitCommandError, Tree, Blob
@@ -12,104 +11,195 @@ from git.repo import Repo
 import structlog
 log = structlog.get_logger()
 
+# Line tags, classifying unidiff lines by their prefix
+_TAG_OTHER = 0
+_TAG_ADDED = 1  # +
+_TAG_REMOVED = 2  # -
+_TAG_HUNK_HEADER = 3  # @@
+_TAG_MINUS_FILE = 4  # ---
+_TAG_PLUS_FILE = 5  # +++
+_PREFIX_TAGS = {
+    "---": _TAG_MINUS_FILE,
+    "+++": _TAG_PLUS_FILE,
+    "-": _TAG_REMOVED,
+    "+": _TAG_ADDED,
+}
+
+# How much each tagged hunk body line adds to the (x, y) line counts, indexed by tag
+_TAG_LINE_COUNTS = (
+    (1, 1),  # _TAG_OTHER
+    (0, 1),  # _TAG_ADDED
+    (1, 0),  # _TAG_REMOVED
+    (0, 0),  # _TAG_HUNK_HEADER
+    (1, 0),  # _TAG_MINUS_FILE
+    (0, 1),  # _TAG_PLUS_FILE
+)
+
+
+def _tag_line(line: str) -> int:
+    if line.startswith("@@"):
+        return _TAG_HUNK_HEADER
+    tag = _PREFIX_TAGS.get(line[:3])
+    if tag is None:
+        tag = _PREFIX_TAGS.get(line[:1], _TAG_OTHER)
+    return tag
+
+
+def _is_file_header(tags: list[int], i: int) -> bool:
+    # Check if the `--- +++ @@` block of a hunk starts at line i
+    return (
+        i + 2 < len(tags) and
+        tags[i] == _TAG_MINUS_FILE and
+        tags[i + 1] == _TAG_PLUS_FILE and
+        tags[i + 2] == _TAG_HUNK_HEADER
+    )
+
+
+def _parse_header_filename(line: str) -> Optional[str]:
+    # Extract the filename from a `--- filename` or `+++ filename` line
+    if len(line) <= 4 or line[3] != " ":
+        return None
+    return line[4:]
+
+
+def _parse_hunk_range(hunk_range: str, sign: str) -> Optional[int]:
+    # Parse `-start[,count]` or `+start[,count]`, returning the start
+    if not hunk_range.startswith(sign):
+        return None
+    start, comma, count = hunk_range[1:].partition(',')
+    if not start.isdecimal() or (comma and not count.isdecimal()):
+        return None
+    return int(start)
+
+
+def _parse_hunk_header(line: str) -> Optional[tuple[int, int]]:
+    """
+    Extract the start line numbers from a `@@ -x[,a] +y[,b] @@` hunk header,
+    or return None if the line is not a well-formed hunk header.
+    """
+    parts = line.split(' ', 4)
+    if len(parts) < 4 or parts[0] != '@@' or not parts[3].startswith('@@'):
+        return None
+    start_x = _parse_hunk_range(parts[1], '-')
+    start_y = _parse_hunk_range(parts[2], '+')
+    if start_x is None or start_y is None:
+        return None
+    return start_x, start_y
+
 
 def fix_unidiff_line_counts(lines: list[str]) -> list[str]:
     # TODO also fix unidiff line numbers
-    corrected_lines = []
-
+    corrected_lines = list(lines)
+
+    # Count the lines of each hunk in a single pass,
+    # rewriting its @@ line once the next hunk (or the end of the diff) is reached
+    tags = [_tag_line(line) for line in lines]
+    hunk_header_index: Optional[int] = None
+    start_x, start_y = 0, 0
+    x_count, y_count = 0, 0
     for i, line in enumerate(lines):
-        if line.startswith("@@"):
-            # Extract the original x and y values
-            match = re.match(r"@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@", line)
-            if match is None:
-                start_x, start_y = 0, 0
-            else:
-                start_x, start_y = int(match.group(1)), int(match.group(2))
-
-            # Calculate the correct y values based on the hunk content
-            x_count, y_count = 0, 0
-            j = i + 1
-            while j < len(lines):
-                # Check if the next hunk is detected
-                if (
-                    j + 2 < len(lines) and
-                    lines[j].startswith("---") and
-                    lines[j + 1].startswith("+++") and
-                    lines[j + 2].startswith("@@")
-                ) or lines[j].startswith("@@"):
-                    break
-
-                if lines[j].startswith("-"):
-                    x_count += 1
-                elif lines[j].startswith("+"):
-                    y_count += 1
-                elif lines[j]:
-                    x_count += 1
-                    y_count += 1
-
-                j += 1
-
-            # Update the @@ line with the correct y values
-            corrected_line = f"@@ -{start_x},{x_count} +{start_y},{y_count} @@"
-            corrected_lines.append(corrected_line)
-        else:
-            corrected_lines.append(line)
+        tag = tags[i]
+        is_hunk_header = tag == _TAG_HUNK_HEADER
+        # Check if the next hunk is detected
+        if is_hunk_header or _is_file_header(tags, i):
+            if hunk_header_index is not None:
+                # Update the @@ line with the correct x and y values
+                corrected_lines[hunk_header_index] = f"@@ -{start_x},{x_count} +{start_y},{y_count} @@"
+                hunk_header_index = None
+            if is_hunk_header:
+                # Extract the original x and y values
+                hunk_start = _parse_hunk_header(line)
+                if hunk_start is None:
+                    start_x, start_y = 0, 0
+                else:
+                    start_x, start_y = hunk_start
+                x_count, y_count = 0, 0
+                hunk_header_index = i
+            continue
+
+        if hunk_header_index is None or not line:
+            continue
+        x_delta, y_delta = _TAG_LINE_COUNTS[tag]
+        x_count += x_delta
+        y_count += y_delta
+
+    if hunk_header_index is not None:
+        corrected_lines[hunk_header_index] = f"@@ -{start_x},{x_count} +{start_y},{y_count} @@"
 
     return corrected_lines
 
 
 def adjust_line_indentation(line: str, indentation_offset: int) -> str:
-    if indentation_offset >= 0:
+    if indentation_offset == 0:
+        return line
+    elif indentation_offset > 0:
         return indentation_offset * ' ' + line
     else:
         return line[-indentation_offset:]
 
 
+def _index_stripped_lines(lines: list[str]) -> dict[str, list[int]]:
+    # Map each left-stripped line to the (ascending) line numbers it appears on
+    index: dict[str, list[int]] = {}
+    for line_number, line in enumerate(lines):
+        index.setdefault(line.lstrip(), []).append(line_number)
+    return index
+
+
 def remove_hallucinations(lines: List[str], tree: Tree) -> List[str]:
     cleaned_lines: list[str] = []
+    current_filepath: str = ""
     current_file_content: Optional[list[str]] = None
+    # Consecutive hunks often refer to the same file, so read and index each file once
+    file_cache: dict[str, Optional[list[str]]] = {}
+    stripped_line_index_cache: dict[str, dict[str, list[int]]] = {}
     current_line_number: int = 0
     search_range: int = 20
     first_line_semaphore: int = 0
     indentation_offset: int = 0
 
+    tags = [_tag_line(line) for line in lines]
     for i, line in enumerate(lines):
+        tag = tags[i]
         first_line_semaphore = max(0, first_line_semaphore - 1)
-        if line.startswith("---") and lines[i + 1].startswith("+++") and lines[i + 2].startswith("@@"):  # hunk header
+        if _is_file_header(tags, i):  # hunk header
 
             # Extract the filename after ---
-            filepath_match = re.match(r"--- (.+)", line)
-            if filepath_match is None:
+            filepath = _parse_header_filename(line)
+            if filepath is None:
                 log.error("Invalid diff", diff=lines)
                 raise ValueError(f"Invalid diff line: {line}")
-            filepath = filepath_match.group(1)
 
             # Get the file content
-            try:
-                blob = tree / filepath
-                current_file_content = blob.data_stream.read().decode().splitlines()
-            except KeyError:
-                current_file_content = None
+            current_filepath = filepath
+            if filepath not in file_cache:
+                try:
+                    blob = tree / filepath
+                    file_cache[filepath] = blob.data_stream.read().decode().splitlines()
+                except KeyError:
+                    file_cache[filepath] = None
+            current_file_content = file_cache[filepath]
+            if current_file_content is None:
                 current_line_number = 0
 
             cleaned_lines.append(line)
-        elif line.startswith("@@"):  # line count (hunk header 3/3)
+        elif tag == _TAG_HUNK_HEADER:  # line count (hunk header 3/3)
             if current_file_content is None:
                 current_line_number = 1
                 cleaned_lines.append("@@ -0,0 +1,0 @@")
                 continue
-            match = re.match(r"@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@", line)
-            if match is None:
+            hunk_start = _parse_hunk_header(line)
+            if hunk_start is None:
                 current_line_number = 1
                 cleaned_lines.append("@@ -1,0 +1,0 @@")
             else:
-                current_line_number = int(match.group(1)) - 1
+                current_line_number = hunk_start[0] - 1
                 cleaned_lines.append(line)
             indentation_offset = 0
             first_line_semaphore = 2
-        elif line.startswith("+++"):  # filename (hunk header 2/2)
+        elif tag == _TAG_PLUS_FILE:  # filename (hunk header 2/2)
             cleaned_lines.append(line)
-        elif line.startswith("-"):  # remove line
+        elif tag == _TAG_REMOVED or tag == _TAG_MINUS_FILE:  # remove line
             if current_file_content is None:
                 continue
             line_content = line[1:]
@@ -119,27 +209,28 @@ def remove_hallucinations(lines: List[str], tree: Tree) -> List[str]:
             # Put the right line into the diff
             cleaned_lines.append(f"-{file_line}")
             current_line_number += 1
-            if line_content.lstrip() != file_line.lstrip():
+            stripped_line_content = line_content.lstrip()
+            stripped_file_line = file_line.lstrip()
+            if stripped_line_content != stripped_file_line:
                 continue
-            if (
-                line_content != file_line and
-                line_content.lstrip() == file_line.lstrip()
-            ):
+            if line_content != file_line:
                 # Fix indentation also in + lines
-                real_indentation = len(file_line) - len(file_line.lstrip())
-                hallucinated_indentation = len(line_content) - len(line_content.lstrip())
+                real_indentation = len(file_line) - len(stripped_file_line)
+                hallucinated_indentation = len(line_content) - len(stripped_line_content)
                 indentation_offset = real_indentation - hallucinated_indentation
-        elif line.startswith("+"):  # new line
+        elif tag == _TAG_ADDED:  # new line
             if line[1:]:
                 cleaned_lines.append(f"+{adjust_line_indentation(line[1:], indentation_offset)}")
             else:
                 cleaned_lines.append("+")
-        elif line.lstrip() != line:  # context line
+        elif line[:1].isspace():  # context line
             # Line has a leading whitespace, check if it's in the actual file content
             if current_file_content is None or current_line_number >= len(current_file_content):
                 continue
+            stripped_line = line.lstrip()
             file_line = current_file_content[current_line_number]
-            if line.lstrip() == file_line.lstrip():
+            stripped_file_line = file_line.lstrip()
+            if stripped_line == stripped_file_line:
                 # If indentation is wrong, use that
                 if indentation_offset:
                     if not file_line:
@@ -149,33 +240,35 @@ def remove_hallucinations(lines: List[str], tree: Tree) -> List[str]:
                 else:  # Else, use the real line
                     cleaned_lines.append(f" {file_line}")
                     # Fix indentation also in + lines
-                    real_indentation = len(file_line) - len(file_line.lstrip())
-                    hallucinated_indentation = len(line[1:]) - len(line.lstrip())
+                    real_indentation = len(file_line) - len(stripped_file_line)
+                    hallucinated_indentation = len(line) - 1 - len(stripped_line)
                     indentation_offset = real_indentation - hallucinated_indentation
                 current_line_number += 1
             elif first_line_semaphore:
-                # Search for the line in the file content
-                # Organize the search range from the current line number outward
-                search_offset_list = list(range(-search_range, search_range + 1))
-                search_offset_list.sort(key=abs)
-                for offset in search_offset_list:
-                    check_line_number = current_line_number + offset
-                    if not 0 <= check_line_number < len(current_file_content):
-                        continue
+                # Search for the line in the file content, nearest to the current line number
+                stripped_line_index = stripped_line_index_cache.get(current_filepath)
+                if stripped_line_index is None:
+                    stripped_line_index = _index_stripped_lines(current_file_content)
+                    stripped_line_index_cache[current_filepath] = stripped_line_index
+                candidates = [
+                    check_line_number
+                    for check_line_number in stripped_line_index.get(stripped_line, [])
+                    if abs(check_line_number - current_line_number) <= search_range
+                ]
+                if candidates:
+                    check_line_number = min(candidates, key=lambda n: (abs(n - current_line_number), n))
                     check_file_line = current_file_content[check_line_number]
-                    if line.lstrip() == check_file_line.lstrip():
-                        current_line_number = check_line_number + 1
-                        # Fix @@ line
-                        cleaned_lines[-1] = f"@@ -{check_line_number + 1},1 +{check_line_number + 1},1 @@"
-                        cleaned_lines.append(f' {check_file_line}')
-                        break
+                    current_line_number = check_line_number + 1
+                    # Fix @@ line
+                    cleaned_lines[-1] = f"@@ -{check_line_number + 1},1 +{check_line_number + 1},1 @@"
+                    cleaned_lines.append(f' {check_file_line}')
             elif file_line == "":
                 # Look forward for the line, as long as you're looking through empty lines
                 for check_line_number in range(current_line_number + 1, len(current_file_content)):
                     check_file_line = current_file_content[check_line_number]
                     if check_file_line == "":
                         continue
-                    if line.lstrip() != check_file_line.lstrip():
+                    if stripped_line != check_file_line.lstrip():
                         break
                     # Add as many newlines as needed
                     newline_count = check_line_number - current_line_number
@@ -190,206 +283,244 @@ def remove_hallucinations(lines: List[str], tree: Tree) -> List[str]:
             else:
                 log.warning("Unknown line: ", line=line)
 
-    if cleaned_lines[-1] != "":
+    if cleaned_lines:
         cleaned_lines[-1] = ""
     return cleaned_lines
 
 
-def create_unidiff_validator(repo: Repo, diff_service: DiffService):
-    class Unidiff(Validator):
-        """Validate value is a valid unidiff.
-        - Name for `format` attribute: `unidiff`
-        - Supported data types: `string`
-        """
+@register_validator(name="unidiff", data_type="string")
+class Unidiff(Validator):
+    """Validate value is a valid unidiff.
+    - Name for `format` attribute: `unidiff`
+    - Supported data types: `string`
+    """
 
-        def validate_with_correction(self, key, value, schema) -> Dict:
-            error_event = EventDetail(key, value, schema, "", None)
-            fixed_schema = self.fix(error_event)
-            fixed_value = fixed_schema[key]
+    # Set by `create_unidiff_validator`, as guardrails instantiates validators by name
+    repo: Repo
+    diff_service: DiffService
 
-            try:
-                self.validate(key, fixed_value, fixed_schema)
-            except EventDetail:
-                log.warning("Failed to fix unidiff", key=key, value=value)
-                schema[key] = None
+    # Blob paths of the last tree seen, and the path each filename was resolved to in it
+    tree_paths_cache: dict[str, tuple[list[str], dict[str, Optional[str]]]] = {}
 
-            return schema
+    def find_path_by_suffix(self, tree: Tree, filename: str) -> Optional[str]:
+        """
+        Find the first path in the tree that ends with `filename`, in traversal order.
+        """
+        if tree.hexsha not in self.tree_paths_cache:
+            self.tree_paths_cache.clear()
+            blob_paths = [
+                tree_file.path for tree_file in tree.traverse()
+                if isinstance(tree_file, Blob)
+            ]
+            self.tree_paths_cache[tree.hexsha] = (blob_paths, {})
+        blob_paths, resolved_paths = self.tree_paths_cache[tree.hexsha]
+        if filename not in resolved_paths:
+            resolved_paths[filename] = next(
+                (path for path in blob_paths if path.endswith(filename)),
+                None,
+            )
+        return resolved_paths[filename]
 
-        def validate(self, key: str, value: Any, schema: Union[Dict, List]) -> Union[Dict, List]:
-            log.debug(f"Validating unidiff...", value=value)
+    def validate_with_correction(self, key, value, schema) -> Dict:
+        error_event = EventDetail(key, value, schema, "", None)
+        fixed_schema = self.fix(error_event)
+        fixed_value = fixed_schema[key]
 
-            try:
-                diff_service.apply_diff(value, check=True)
-            except GitCommandError as e:
-                log.warning("Failed to apply unidiff", key=key, value=value, stderr=e.stderr)
-                raise EventDetail(
-                    key,
-                    value,
-                    schema,
-                    e.stderr,
-                    None,
-                )
+        try:
+            self.validate(key, fixed_value, fixed_schema)
+        except EventDetail:
+            log.warning("Failed to fix unidiff", key=key, value=value)
+            schema[key] = None
 
-            return schema
+        return schema
 
-        def fix(self, error: EventDetail) -> Any:
-            log.debug("Fixing unidiff...", value=error.value)
+    def validate(self, key: str, value: Any, schema: Union[Dict, List]) -> Union[Dict, List]:
+        log.debug(f"Validating unidiff...", value=value)
 
-            tree = repo.head.commit.tree
-            value = error.value
-            lines = value.splitlines()
+        try:
+            self.diff_service.apply_diff(value, check=True)
+        except GitCommandError as e:
+            log.warning("Failed to apply unidiff", key=key, value=value, stderr=e.stderr)
+            raise EventDetail(
+                key,
+                value,
+                schema,
+                e.stderr,
+                None,
+            )
 
-            # Drop any `diff --git` lines
-            lines = [line for line in lines if not line.startswith("diff --git")]
+        return schema
 
-            if not lines:
-                return error.schema
+    def fix(self, error: EventDetail) -> Any:
+        log.debug("Fixing unidiff...", value=error.value)
 
-            # Remove whitespace in front of --- lines if it's there
-            for i, line in enumerate(lines):
-                stripped_line = line.lstrip()
-                if stripped_line.startswith("---") and \
-                        lines[i + 1].startswith("+++") and \
-                        lines[i + 2].startswith("@@"):
-                    lines[i] = stripped_line
+        tree = self.repo.head.commit.tree
+        value = error.value
+        lines = value.splitlines()
 
-            # Add space at the start of any line that's empty, except if it precedes a --- line, or is the last line
-            for i, line in enumerate(lines):
-                if len(lines) < i + 2:
-                    break
-                if line == "" and not lines[i + 1].startswith("---") and i != len(lines) - 1:
-                    lines[i] = " "
+        # Drop any `diff --git` lines
+        if "diff --git" in value:
+            lines = [line for line in lines if not line.startswith("diff --git")]
 
-            # Ensure the whole thing ends with a newline
-            if not lines[-1] == "":
-                lines.append("")
+        if not lines:
+            return error.schema
 
-            # If there are any +++ @@ lines, without a preceding --- line,
-            # add a `--- /dev/null` line before it
-            insert_indices: list[int] = []
+        # Remove whitespace in front of --- lines if it's there
+        for i, line in enumerate(lines):
+            stripped_line = line.lstrip()
+            if stripped_line.startswith("---") and \
+                    lines[i + 1].startswith("+++") and \
+                    lines[i + 2].startswith("@@"):
+                lines[i] = stripped_line
+
+        # Add space at the start of any line that's empty, except if it precedes a --- line, or is the last line
+        for i, line in enumerate(lines):
+            if len(lines) < i + 2:
+                break
+            if line == "" and not lines[i + 1].startswith("---") and i != len(lines) - 1:
+                lines[i] = " "
+
+        # Ensure the whole thing ends with a newline
+        if not lines[-1] == "":
+            lines.append("")
+
+        # If there are any +++ @@ lines, without a preceding --- line,
+        # add a `--- /dev/null` line before it
+        insert_indices: set[int] = set()
+        for i, line in enumerate(lines):
+            if line.startswith("+++ ") and lines[i + 1].startswith('@@ ') and not lines[i - 1].startswith("---"):
+                insert_indices.add(i)
+        if insert_indices:
+            fixed_lines: list[str] = []
             for i, line in enumerate(lines):
-                if line.startswith("+++ ") and lines[i + 1].startswith('@@ ') and not lines[i - 1].startswith("---"):
-                    insert_indices.append(i)
-            for i, index in enumerate(insert_indices):
-                lines.insert(index + i, "--- /dev/null")
+                if i in insert_indices:
+                    fixed_lines.append("--- /dev/null")
+                fixed_lines.append(line)
+            lines = fixed_lines
+
+        # Normalize the filenames of every --- +++ block in a single pass.
+        # Each step only rewrites lines i and i + 1, and never depends on a line that a later
+        # iteration rewrites, so this is equivalent to running each step as a separate pass.
+        for i in range(len(lines) - 1):
+            line = lines[i]
 
             # Rename any hunks that start with --- a/ or +++ b/
-            for i, line in enumerate(lines):
-                if len(lines) < i + 2:
-                    break
-                if line.startswith("--- /dev/null") and lines[i + 1].startswith("+++ b/"):
-                    lines[i + 1] = lines[i + 1].replace("+++ b/", "+++ ")
-                elif line.startswith("--- a/") and lines[i + 1].startswith("+++ b/"):
-                    lines[i] = line.replace("--- a/", "--- ")
-                    lines[i + 1] = lines[i + 1].replace("+++ b/", "+++ ")
+            if line.startswith("--- /dev/null") and lines[i + 1].startswith("+++ b/"):
+                lines[i + 1] = lines[i + 1].replace("+++ b/", "+++ ")
+            elif line.startswith("--- a/") and lines[i + 1].startswith("+++ b/"):
+                line = lines[i] = line.replace("--- a/", "--- ")
+                lines[i + 1] = lines[i + 1].replace("+++ b/", "+++ ")
+
+            if i + 2 >= len(lines) or not (
+                line.startswith("---") and
+                lines[i + 1].startswith("+++") and
+                lines[i + 2].startswith("@@")
+            ):
+                continue
 
             # Fix filenames, such that in every block of three consecutive --- +++ @@ lines,
             # the filename after +++ matches the filename after ---
             # Except the filename after --- is /dev/null
-            for i, line in enumerate(lines):
-                if len(lines) < i + 3:
-                    break
-                if line.startswith("---") and not line.startswith("--- /dev/null") and \
-                        lines[i + 1].startswith("+++ ") and lines[i + 2].startswith("@@"):
-                    # Extract the filenames
-                    minus_filename_match = re.match(r"--- (.+)", line)
-                    plus_filename_match = re.match(r"\+\+\+ (.+)", lines[i + 1])
-
-                    filenames = []
-                    if minus_filename_match is not None:
-                        filenames.append(minus_filename_match.group(1))
-                    if plus_filename_match is not None:
-                        filenames.append(plus_filename_match.group(1))
-                    # If both filenames are present, use the shorter one
-                    if len(filenames) == 2:
-                        filename = min(filenames, key=len)
-                    # If only one filename is present, use that
-                    elif len(filenames) == 1:
-                        filename = filenames[0]
-                    # If neither filename is present, use new_file
-                    else:
-                        filename = "new_file"
-
-                    # Set the filename
-                    lines[i] = f"--- {filename}"
-                    lines[i + 1] = f"+++ {filename}"
+            if not line.startswith("--- /dev/null") and lines[i + 1].startswith("+++ "):
+                # Extract the filenames
+                minus_filename = _parse_header_filename(line)
+                plus_filename = _parse_header_filename(lines[i + 1])
+
+                filenames = []
+                if minus_filename is not None:
+                    filenames.append(minus_filename)
+                if plus_filename is not None:
+                    filenames.append(plus_filename)
+                # If both filenames are present, use the shorter one
+                if len(filenames) == 2:
+                    filename = min(filenames, key=len)
+                # If only one filename is present, use that
+                elif len(filenames) == 1:
+                    filename = filenames[0]
+                # If neither filename is present, use new_file
+                else:
+                    filename = "new_file"
+
+                # Set the filename
+                lines[i] = f"--- {filename}"
+                lines[i + 1] = f"+++ {filename}"
 
             # If the file referenced on --- and +++ lines is not in the repo, replace it with /dev/null
+            # Extract the filename after +++
+            filename = _parse_header_filename(lines[i + 1])
+            if filename is None:
+                filename = "new_file"
+
+            # Check if the file is in the tree
+            if filename not in tree:
+                # See if any of the filepaths in the tree end with the filename
+                # If so, use that as the filename
+                path = self.find_path_by_suffix(tree, filename)
+                if path is not None:
+                    lines[i] = f"--- {path}"
+                    lines[i + 1] = f"+++ {path}"
+                else:
+                    lines[i] = f"--- /dev/null"
+
+        # If there is a lone @@ line, prefix it with the --- and +++ lines from the previous block
+        current_block: list[str] = []
+        insertions: dict[int, list[str]] = {}
+        for i, line in enumerate(lines):
+            if line.startswith("---") and lines[i + 1].startswith("+++ ") and lines[i + 2].startswith("@@"):
+                current_block = [lines[i], lines[i + 1]]
+            if line.startswith("@@") and not lines[i - 1].startswith("+++ "):
+                insertions[i] = current_block
+        if insertions:
+            fixed_lines = []
             for i, line in enumerate(lines):
-                if line.startswith("---") and lines[i + 1].startswith("+++") and lines[i + 2].startswith("@@"):
-                    # Extract the filename after +++
-                    filename_match = re.match(r"\+\+\+ (.+)", lines[i + 1])
-                    if filename_match is None:
-                        filename = "new_file"
-                    else:
-                        filename = filename_match.group(1)
-
-                    # Check if the file is in the tree
-                    if filename not in tree:
-                        # See if any of the filepaths in the tree end with the filename
-                        # If so, use that as the filename
-                        for tree_file in tree.traverse():
-                            if not isinstance(tree_file, Blob):
-                                continue
-
-                            path = tree_file.path
-                            if path.endswith(filename):
-                                lines[i] = f"--- {path}"
-                                lines[i + 1] = f"+++ {path}"
-                                break
-                        else:
-                            lines[i] = f"--- /dev/null"
-
-            # If there is a lone @@ line, prefix it with the --- and +++ lines from the previous block
-            current_block: list[str] = []
-            insertions: list[tuple[int, list[str]]] = []
-            for i, line in enumerate(lines):
-                if line.startswith("---") and lines[i + 1].startswith("+++ ") and lines[i + 2].startswith("@@"):
-                    current_block = [lines[i], lines[i + 1]]
-                if line.startswith("@@") and not lines[i - 1].startswith("+++ "):
-                    insertions.append((i, current_block))
-            for i, (index, newlines) in enumerate(insertions):
-                actual_index = index + i * 2
-                lines.insert(actual_index, newlines[0])
-                lines.insert(actual_index + 1, newlines[1])
-
-            # If it's a new file (--- starts with /dev/null), make all the lines in the hunk start with +
-            for i, line in enumerate(lines):
-                if line.startswith("--- /dev/null") and lines[i + 1].startswith("+++ ") and lines[i + 2].startswith("@@"):
-                    j = i + 3
-                    while j < len(lines) and not (lines[j].startswith("---") and lines[j + 1].startswith("+++") and lines[j + 2].startswith("@@")):
-                        if lines[j].startswith(" "):
-                            lines[j] = "+" + lines[j][1:]
-                        elif lines[j].startswith("-"):
-                            lines[j] = "+" + lines[j][1:]
-                        elif not lines[j].startswith("+"):
-                            lines[j] = "+" + lines[j]
-                        j += 1
-
-            # Filter out new lines if they are the first line in a hunk
-            remove_indices = []
-            for i, line in enumerate(lines):
-                if line.startswith("@@"):
-                    # Find the next line that isn't a space
-                    j = i + 1
-                    while lines[j] == " ":
-                        remove_indices.append(j)
-                        j += 1
-            for i in sorted(remove_indices, reverse=True):
-                del lines[i]
-
-            # Recalculate the @@ line and remove hallucinated lines
-            lines = remove_hallucinations(lines, tree)
-
-            # Recalculate the line counts in the unidiff
-            lines = fix_unidiff_line_counts(lines)
+                if i in insertions:
+                    fixed_lines.extend(insertions[i])
+                fixed_lines.append(line)
+            lines = fixed_lines
+
+        # If it's a new file (--- starts with /dev/null), make all the lines in the hunk start with +
+        for i, line in enumerate(lines):
+            if line.startswith("--- /dev/null") and lines[i + 1].startswith("+++ ") and lines[i + 2].startswith("@@"):
+                j = i + 3
+                while j < len(lines) and not (lines[j].startswith("---") and lines[j + 1].startswith("+++") and lines[j + 2].startswith("@@")):
+                    if lines[j].startswith(" "):
+                        lines[j] = "+" + lines[j][1:]
+                    elif lines[j].startswith("-"):
+                        lines[j] = "+" + lines[j][1:]
+                    elif not lines[j].startswith("+"):
+                        lines[j] = "+" + lines[j]
+                    j += 1
+
+        # Filter out new lines if they are the first line in a hunk
+        remove_indices: set[int] = set()
+        for i, line in enumerate(lines):
+            if line.startswith("@@"):
+                # Find the next line that isn't a space
+                j = i + 1
+                while lines[j] == " ":
+                    remove_indices.add(j)
+                    j += 1
+        if remove_indices:
+            lines = [line for i, line in enumerate(lines) if i not in remove_indices]
+
+        # Recalculate the @@ line and remove hallucinated lines
+        lines = remove_hallucinations(lines, tree)
+
+        # Recalculate the line counts in the unidiff
+        lines = fix_unidiff_line_counts(lines)
+
+        value = "\n".join(lines)
 
-            value = "\n".join(lines)
+        error.schema[error.key] = value
+        return error.schema
 
-            error.schema[error.key] = value
-            return error.schema
 
-    return register_validator(name="unidiff", data_type="string")(Unidiff)
+def create_unidiff_validator(repo: Repo, diff_service: DiffService):
+    Unidiff.repo = repo
+    Unidiff.diff_service = diff_service
+    # Results cached for a previous repo don't carry over
+    Unidiff.tree_paths_cache = {}
+    return Unidiff
 
 
 @register_validator(name="filepath", data_type="string")